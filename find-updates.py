@@ -11,6 +11,8 @@ import json
 import os
 import random
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 import tweepy
@@ -18,13 +20,57 @@ import yaml
 from atproto import Client as BlueskyClient
 from atproto import client_utils
 from mastodon import Mastodon
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Prefer the libyaml C bindings, the pure Python loader is much slower
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+if not yaml.__with_libyaml__:
+    print("Warning: libyaml is not available, yaml parsing will be slow.")
+
+
+# Implicit scalar types resolved by the FastLoader, everything else is a string
+resolved_tags = (
+    "tag:yaml.org,2002:null",
+    "tag:yaml.org,2002:bool",
+    "tag:yaml.org,2002:int",
+    "tag:yaml.org,2002:merge",
+)
+
+
+class FastLoader(SafeLoader):
+    """
+    A SafeLoader that only resolves null, bool and int (and merge) scalars.
+
+    Job files are nearly all strings, so this skips the timestamp, float and
+    other regex checks on every scalar. Dates are kept as strings.
+    """
+
+    yaml_implicit_resolvers = {
+        first: [(tag, regexp) for tag, regexp in resolvers if tag in resolved_tags]
+        for first, resolvers in SafeLoader.yaml_implicit_resolvers.items()
+    }
+
+
+# orjson is faster to serialize the webhook payloads, if installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Shared headers for slack / discord
 headers = {"Content-type": "application/json"}
 success_codes = [200, 201, 204]
 
+# The slack payload has a fixed shape, only the (escaped) text changes
+slack_payload = b'{"text": %s, "unfurl_links": true}'
 
-icons = [
+
+icons = (
     "⭐️",
     "😍️",
     "❤️",
@@ -43,7 +89,25 @@ icons = [
     "🕶️",
     "🔥️",
     "💻️",
-]
+)
+
+
+def dumps(data):
+    """
+    Serialize a webhook payload to json bytes, using orjson if it is installed.
+
+    Values json cannot represent (e.g., dates) are converted to string.
+    Anything orjson rejects (e.g., integers over 64 bits) falls back to
+    the json module.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(
+        data, default=str, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
 
 
 def read_yaml(filename):
@@ -51,10 +115,202 @@ def read_yaml(filename):
     Read yaml from file.
     """
     with open(filename, "r") as stream:
-        content = yaml.load(stream, Loader=yaml.FullLoader)
+        content = yaml.load(stream, Loader=FastLoader)
+    return content
+
+
+def compose_node(loader, event, events, anchors):
+    """
+    Compose a yaml node from its first event and an iterator of the rest.
+    """
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(
+                None, None, f"found undefined alias {event.anchor}", event.start_mark
+            )
+        return anchors[event.anchor]
+
+    tag = event.tag
+    if isinstance(event, yaml.ScalarEvent):
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark, style=event.style
+        )
+    else:
+        kind = yaml.MappingNode
+        if isinstance(event, yaml.SequenceStartEvent):
+            kind = yaml.SequenceNode
+        if tag is None or tag == "!":
+            tag = loader.resolve(kind, None, event.implicit)
+        children = []
+        for child in events:
+            if isinstance(child, yaml.CollectionEndEvent):
+                break
+            children.append(compose_node(loader, child, events, anchors))
+        if kind is yaml.MappingNode:
+            children = list(zip(children[::2], children[1::2]))
+        node = kind(tag, children, event.start_mark, flow_style=event.flow_style)
+
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def mapping_value(node, key):
+    """
+    Get the value node for a string key set in a mapping node itself.
+
+    Returns None if it isn't (it may still come from a merge key).
+    """
+    for key_node, value_node in reversed(node.value):
+        if (
+            isinstance(key_node, yaml.ScalarNode)
+            and key_node.tag == "tag:yaml.org,2002:str"
+            and key_node.value == key
+        ):
+            return value_node
+
+
+def stream_entries(filename, needed_keys=None, unique=None, seen=()):
+    """
+    Yield entries from a yaml list of jobs, one list item at a time.
+
+    The full document is never built. Only needed_keys are kept (all keys
+    if None). If unique is given, entries with a unique value in seen are
+    skipped, only constructing the unique value when possible. Items that
+    are not mappings are skipped.
+    """
+    anchors = {}
+    with open(filename, "r") as stream:
+        loader = FastLoader(stream)
+
+        # Each item is composed straight from the parser events
+        events = iter(loader.get_event, None)
+        try:
+            loader.get_event()
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            document = loader.get_event()
+            if not loader.check_event(yaml.SequenceStartEvent):
+                raise yaml.composer.ComposerError(
+                    None, None, f"expected a list of jobs in {filename}"
+                )
+            loader.get_event()
+
+            while not loader.check_event(yaml.SequenceEndEvent):
+                node = compose_node(loader, loader.get_event(), events, anchors)
+
+                # Don't hold on to values constructed for earlier entries
+                loader.constructed_objects = {}
+                if not isinstance(node, yaml.MappingNode):
+                    continue
+
+                value = None
+                if unique is not None:
+                    value = mapping_value(node, unique)
+                if value is not None:
+                    if loader.construct_object(value, deep=True) in seen:
+                        continue
+
+                # The whole mapping is constructed so merge keys (<<) apply
+                entry = loader.construct_object(node, deep=True)
+                if unique is not None and value is None:
+                    if entry.get(unique) in seen:
+                        continue
+                if needed_keys is not None:
+                    entry = {k: v for k, v in entry.items() if k in needed_keys}
+                yield entry
+
+            # Like yaml.load, a file with more than one document is an error
+            loader.get_event()  # end of the list
+            loader.get_event()  # end of the document
+            if not loader.check_event(yaml.StreamEndEvent):
+                raise yaml.composer.ComposerError(
+                    "expected a single document in the stream",
+                    document.start_mark,
+                    "but found another document",
+                    loader.get_event().start_mark,
+                )
+        finally:
+            loader.dispose()
+
+
+def read_yaml_cached(filename):
+    """
+    Read yaml from file, reusing a json cache next to it when still valid.
+
+    The cache stores the mtime and size of the yaml file it was built from,
+    so one stat is enough to validate it. Values that json cannot represent
+    (e.g., dates) are stored as strings.
+    """
+    st = os.stat(filename)
+    key = [st.st_mtime_ns, st.st_size]
+    cache = filename + ".cache.json"
+    try:
+        with open(cache, "r") as fd:
+            cached = json.load(fd)
+        if cached.get("key") == key:
+            return cached["content"]
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+
+    content = json.loads(json.dumps(read_yaml(filename), default=str))
+
+    # Write to a temporary file first so a partial cache is never read
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache) or ".")
+        with os.fdopen(fd, "w") as stream:
+            json.dump({"key": key, "content": content}, stream)
+        os.replace(tmp, cache)
+    except OSError as e:
+        print(f"Warning: cannot write cache {cache}: {e}")
     return content
 
 
+def unique_entries(items, unique):
+    """
+    Map unique values to job entries, keeping the order of the file.
+
+    Items that are not mappings or have no unique value are ignored.
+    """
+    return {
+        item[unique]: item
+        for item in items
+        if isinstance(item, dict) and item.get(unique)
+    }
+
+
+def find_new_entries(original, updated, unique, cache=False):
+    """
+    Find entries in updated with a unique value that is not in original.
+    """
+    # Cached files are read in full, so both can be read at once
+    if cache:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            entries, items = executor.map(read_yaml_cached, [original, updated])
+        entries = [item for item in entries if isinstance(item, dict)]
+
+    # Otherwise we only need the unique key from the original jobs
+    else:
+        entries = list(stream_entries(original, {unique}))
+    previous = {item[unique] for item in entries if unique in item}
+
+    # Warn the user if some are missing the unique key
+    missing_count = sum(unique not in item for item in entries)
+    if missing_count:
+        print(f"Warning: key {unique} is missing in {missing_count} items.")
+
+    # Entries already seen are skipped while parsing
+    if not cache:
+        items = stream_entries(updated, unique=unique, seen=previous)
+
+    # Create a lookup by the unique id, keeping the order of the file
+    updated_map = unique_entries(items, unique)
+    new_keys = updated_map.keys() - previous
+    return [item for key, item in updated_map.items() if key in new_keys]
+
+
 def write_file(content, filename):
     """
     Write yaml to file.
@@ -63,20 +319,23 @@ def write_file(content, filename):
         fd.write(content)
 
 
-def set_env_and_output(name, value):
+def set_env_and_outputs(outputs):
     """
-    helper function to echo a key/value pair to the environment file
+    helper function to echo key/value pairs to the environment files
+
+    Each file is opened once for all pairs.
 
     Parameters:
-    name (str)  : the name of the environment variable
-    value (str) : the value to write to file
+    outputs (list) : (name, value) pairs to write to file
     """
+    for name, value in outputs:
+        print("Writing %s=%s to GITHUB_ENV and GITHUB_OUTPUT" % (name, value))
+
+    lines = ["%s=%s\n" % (name, value) for name, value in outputs]
     for env_var in ("GITHUB_ENV", "GITHUB_OUTPUT"):
         environment_file_path = os.environ.get(env_var)
-        print("Writing %s=%s to %s" % (name, value, env_var))
-
         with open(environment_file_path, "a") as environment_file:
-            environment_file.write("%s=%s\n" % (name, value))
+            environment_file.writelines(lines)
 
 
 def get_parser():
@@ -176,6 +435,14 @@ def get_parser():
         help="The keys (comma separated list) to post to slack or Twitter",
     )
 
+    update.add_argument(
+        "--cache",
+        dest="cache",
+        action="store_true",
+        default=False,
+        help="cache parsed yaml to <filename>.cache.json, for repeated local runs",
+    )
+
     update.add_argument(
         "--unique",
         dest="unique",
@@ -249,31 +516,58 @@ def get_mastodon_client():
     )
 
 
+def get_session():
+    """
+    Get a requests session so webhook posts share keep-alive connections.
+
+    There is one pool per host (Slack and Discord), so both stay alive.
+    Each host only has one post in flight at a time, so a single connection
+    per pool is enough. Retries only cover connection errors, so a post is
+    never sent twice.
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=1,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def prepare_post(entry, keys, without_url=False):
     """
     Prepare the post.
 
-    There should be a descriptor for all fields except for url.
+    There should be a descriptor for all fields except for url. Keys must
+    already be limited to those present in the entry.
+    """
+    # For BlueSky, we include the url separately with the title
+    skip = ["url", "title", "name"] if without_url else []
+    lines = [
+        f"{entry[key]}\n" if key == "url" else f"{key.capitalize()}: {entry[key]}\n"
+        for key in keys
+        if key not in skip
+    ]
+    return "".join(lines)
+
+
+def send_posts(posts):
+    """
+    Send the posts for one service in order, as (function, *args).
     """
-    post = ""
-    for key in keys:
-        if key in entry:
-            # For BlueSky, we include the url separately with the title
-            if key in ["url", "title", "name"] and without_url:
-                continue
-            if key == "url":
-                post = post + entry[key] + "\n"
-            else:
-                post = post + key.capitalize() + ": " + entry[key] + "\n"
-    return post
+    for func, *args in posts:
+        func(*args)
 
 
-def deploy_slack(webhook, message):
+def deploy_slack(session, webhook, message):
     """
     Deploy a post to slack
     """
-    data = {"text": message, "unfurl_links": True}
-    response = requests.post(webhook, headers=headers, data=json.dumps(data))
+    data = slack_payload % dumps(message)
+    response = session.post(webhook, data=data)
     if response.status_code not in success_codes:
         print(response)
         sys.exit(
@@ -282,15 +576,16 @@ def deploy_slack(webhook, message):
         )
 
 
-def deploy_bluesky(client, entry, keys, hashtags):
+def deploy_bluesky(client, entry, keys, hashtags, choice):
     """
     Deploy to bluesky. We add the job link separately.
+
+    The icon choice is shared with the other services' posts.
     """
     tb = client_utils.TextBuilder()
 
     # Prepare the post, but without the url
     post = prepare_post(entry, keys, without_url=True)
-    choice = random.choice(icons)
     # Add the text to the textbuilder
     # seems like a clumsy way to build such a message...
     tb.text("New ")
@@ -304,12 +599,12 @@ def deploy_bluesky(client, entry, keys, hashtags):
     print(f"Posted to bluesky {response.uri}: {response.cid}")
 
 
-def deploy_discord(webhook, message):
+def deploy_discord(session, webhook, message):
     """
     Deploy a post to Discord
     """
     data = {"content": message}
-    response = requests.post(webhook, headers=headers, data=json.dumps(data))
+    response = session.post(webhook, data=dumps(data))
     if response.status_code not in success_codes:
         print(response)
         sys.exit(
@@ -342,9 +637,25 @@ def main():
     if not args.command:
         help()
 
-    for filename in [args.original, args.updated]:
-        if not os.path.exists(filename):
-            sys.exit(f"{filename} does not exist.")
+    # Get new jobs, test uses all entries so the original is not needed
+    try:
+        if args.test:
+            reader = read_yaml_cached if args.cache else read_yaml
+            new = list(unique_entries(reader(args.updated), args.unique).values())
+        else:
+            new = find_new_entries(
+                args.original, args.updated, args.unique, cache=args.cache
+            )
+    except FileNotFoundError as e:
+        sys.exit(f"{e.filename} does not exist.")
+
+    # Nothing to post, so don't set up any clients
+    if not new and not args.test:
+        print("No new jobs found.")
+        set_env_and_outputs(
+            [("fields", "[]"), ("matrix", "[]"), ("empty_matrix", "true")]
+        )
+        sys.exit(0)
 
     # Deploying to Twitter?
     twitter_client = None
@@ -363,10 +674,7 @@ def main():
     # Prepare webhooks for slack and mastodon
     slack_webhook = os.environ.get("SLACK_WEBHOOK")
     discord_webhook = os.environ.get("DISCORD_WEBHOOK")
-
-    # Get original and updated jobs
-    original = read_yaml(args.original)
-    updated = read_yaml(args.updated)
+    session = get_session()
 
     # Parse keys into list
     keys = [x for x in args.keys.split(",") if x]
@@ -374,61 +682,30 @@ def main():
     # Parse hashtags into list
     hashtags = [x for x in args.hashtag.split(",") if x]
 
-    # Find new posts in updated
-    previous = set()
-    missing_count = 0
-    for item in original:
-        if args.unique in item:
-            previous.add(item[args.unique])
-        else:
-            missing_count += 1
+    matrix = []
 
-    # Warn the user if some are missing the unique key
-    if missing_count:
-        print(f"Warning: key {args.unique} is missing in {missing_count} items.")
-
-    # Create a lookup by the unique id
-    new = []
-    entries = []
-    for item in updated:
-        if args.unique in item and item[args.unique] not in previous:
-            new.append(item)
-
-        # Also keep list of all for test
-        elif args.unique in item and item[args.unique]:
-            entries.append(item)
-
-    # Test uses all entries
-    if args.test:
-        new = entries
-    elif not new:
-        print("No new jobs found.")
-        set_env_and_output("fields", "[]")
-        set_env_and_output("matrix", "[]")
-        set_env_and_output("empty_matrix", "true")
-        sys.exit(0)
+    # Posts to send per service, as (function, *args), kept in file order
+    posts = {"twitter": [], "bluesky": [], "mastodon": [], "slack": [], "discord": []}
 
-    matrix = []
+    # The prefix is the same for every post
+    prefix = "New " + " ".join(hashtags) + " Job!"
+
+    # Pick all icons at once
+    choices = random.choices(icons, k=len(new))
 
-    for entry in new:
+    for entry, choice in zip(new, choices):
         # Prepare the post
-        post = prepare_post(entry, keys)
-        choice = random.choice(icons)
-        message = f"New {(" ".join(hashtags))} Job! {choice}: {post}"
-        newline_message = f"New {(" ".join(hashtags))} Job! {choice}\n{post}"
+        # Only the keys this entry has are formatted for each service
+        present = [key for key in keys if key in entry]
+        post = prepare_post(entry, present)
+        message = f"{prefix} {choice}: {post}"
+        newline_message = f"{prefix} {choice}\n{post}"
         print(message)
 
-        # Convert dates, etc. back to string
-        filtered = {}
-        for k, v in entry.items():
-            try:
-                filtered[k] = json.dumps(v)
-            except:
-                continue
-
-        # Add the job name to the matrix
-        # IMPORTANT: emojis in output can mess up some of the services
-        matrix.append(filtered)
+        # Add the job to the matrix, dates etc. are converted to string below
+        # IMPORTANT: emojis in output can mess up some of the services, so the
+        # outputs are written with json.dumps, which escapes them to ascii
+        matrix.append(entry)
 
         # Don't continue if testing or global deploy is false
         if not args.deploy or args.test is True:
@@ -436,27 +713,45 @@ def main():
 
         # If we are instructed to deploy to twitter and have a client
         if args.deploy_twitter and twitter_client:
-            deploy_twitter(twitter_client, newline_message)
+            posts["twitter"].append((deploy_twitter, twitter_client, newline_message))
 
         if args.deploy_bluesky and bluesky_client:
-            deploy_bluesky(bluesky_client, entry, keys, hashtags)
+            posts["bluesky"].append(
+                (deploy_bluesky, bluesky_client, entry, present, hashtags, choice)
+            )
 
         # If we are instructed to deploy to mastodon and have a client
         if args.deploy_mastodon and mastodon_client:
-            mastodon_client.toot(status=message)
+            posts["mastodon"].append((mastodon_client.toot, message))
 
         # Deploy to Slack
         if slack_webhook is not None and args.deploy_slack:
-            deploy_slack(slack_webhook, message)
+            posts["slack"].append((deploy_slack, session, slack_webhook, message))
 
         # Deploy to Discord
         if discord_webhook is not None and args.deploy_discord:
-            deploy_discord(discord_webhook, message)
+            posts["discord"].append(
+                (deploy_discord, session, discord_webhook, message)
+            )
 
-    set_env_and_output("fields", json.dumps(keys))
-    set_env_and_output("matrix", json.dumps(matrix))
-    set_env_and_output("empty_matrix", "false")
-    print("matrix: %s" % json.dumps(matrix))
+    # Posting is network bound, so services are posted to concurrently
+    # Each service gets its posts in order, one at a time (for rate limits)
+    # Errors (including a sys.exit from a failed webhook) are raised here
+    services = [service_posts for service_posts in posts.values() if service_posts]
+    with ThreadPoolExecutor(max_workers=max(len(services), 1)) as executor:
+        futures = [executor.submit(send_posts, service) for service in services]
+        for future in as_completed(futures):
+            future.result()
+
+    matrix = json.dumps(matrix, default=str)
+    set_env_and_outputs(
+        [
+            ("fields", json.dumps(keys)),
+            ("matrix", matrix),
+            ("empty_matrix", "false"),
+        ]
+    )
+    print("matrix: %s" % matrix)
     print("group: %s" % new)
 
 
@@ -0,0 +1,155 @@
+import importlib.util
+import os
+
+import pytest
+import yaml
+
+here = os.path.dirname(os.path.abspath(__file__))
+script = os.path.join(os.path.dirname(here), "find-updates.py")
+
+
+@pytest.fixture(scope="module")
+def updater():
+    """
+    Import find-updates.py, which can't be imported by name.
+    """
+    spec = importlib.util.spec_from_file_location("find_updates", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def write_jobs(tmp_path):
+    """
+    Write yaml content to a jobs file and return the path.
+    """
+
+    def write(content):
+        path = tmp_path / "jobs.yaml"
+        path.write_text(content)
+        return str(path)
+
+    return write
+
+
+def full_entries(updater, filename):
+    return [item for item in updater.read_yaml(filename) if isinstance(item, dict)]
+
+
+def test_matches_read_yaml_for_examples(updater):
+    for name in ["jobs.yaml", "jobs-previous.yaml"]:
+        filename = os.path.join(os.path.dirname(here), "example", name)
+        assert list(updater.stream_entries(filename)) == full_entries(
+            updater, filename
+        )
+
+
+def test_merge_keys(updater, write_jobs):
+    filename = write_jobs(
+        """
+- &base
+  url: base
+  location: Home
+- <<: *base
+  url: a
+  name: A
+- url: b
+  <<: {location: There, name: B}
+- <<: {url: c, name: C}
+"""
+    )
+    entries = list(updater.stream_entries(filename))
+    assert entries == full_entries(updater, filename)
+    assert entries[1] == {"url": "a", "location": "Home", "name": "A"}
+
+    # A unique key that only comes from a merge is still checked
+    entries = updater.stream_entries(filename, unique="url", seen={"base", "c"})
+    assert [entry["url"] for entry in entries] == ["a", "b"]
+
+
+def test_anchors_in_skipped_entries(updater, write_jobs):
+    filename = write_jobs(
+        """
+- url: seen
+  location: &here Home
+  tags: &tags [a, b]
+- url: new
+  location: *here
+  tags: *tags
+"""
+    )
+    entries = list(updater.stream_entries(filename, unique="url", seen={"seen"}))
+    assert entries == [{"url": "new", "location": "Home", "tags": ["a", "b"]}]
+
+
+def test_aliases_inside_an_entry(updater, write_jobs):
+    filename = write_jobs(
+        """
+- name: &n A
+  url: *n
+"""
+    )
+    assert list(updater.stream_entries(filename)) == [{"name": "A", "url": "A"}]
+    assert list(updater.stream_entries(filename, unique="url", seen={"A"})) == []
+
+
+def test_alias_items(updater, write_jobs):
+    filename = write_jobs(
+        """
+- &job {url: a, name: A}
+- *job
+"""
+    )
+    entries = list(updater.stream_entries(filename, {"url"}))
+    assert entries == [{"url": "a"}, {"url": "a"}]
+
+
+def test_quoted_keys(updater, write_jobs):
+    filename = write_jobs(
+        """
+- "url": a
+  'name': A
+- url: b
+"""
+    )
+    entries = updater.stream_entries(filename, unique="url", seen={"b"})
+    assert list(entries) == [{"url": "a", "name": "A"}]
+
+
+def test_needed_keys_and_non_mappings(updater, write_jobs):
+    filename = write_jobs(
+        """
+- url: a
+  name: A
+  tags: [x]
+- just a string
+- [a, list]
+"""
+    )
+    assert list(updater.stream_entries(filename, {"url", "tags"})) == [
+        {"url": "a", "tags": ["x"]}
+    ]
+
+
+def test_empty_document(updater, write_jobs):
+    filename = write_jobs("# no jobs yet\n")
+    assert list(updater.stream_entries(filename)) == []
+
+
+def test_not_a_list(updater, write_jobs):
+    filename = write_jobs("url: a\n")
+    with pytest.raises(yaml.composer.ComposerError, match="expected a list of jobs"):
+        list(updater.stream_entries(filename))
+
+
+def test_undefined_alias(updater, write_jobs):
+    filename = write_jobs("- url: *nope\n")
+    with pytest.raises(yaml.composer.ComposerError, match="undefined alias"):
+        list(updater.stream_entries(filename))
+
+
+def test_more_than_one_document(updater, write_jobs):
+    filename = write_jobs("- url: a\n---\n- url: b\n")
+    with pytest.raises(yaml.composer.ComposerError, match="single document"):
+        list(updater.stream_entries(filename))